@@ -1,16 +1,20 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import cv2
 import numpy as np
 import base64
-import json
+import orjson
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
 from datetime import datetime
 import logging
 
-from emotion_detector import EmotionDetector
+from emotion_detector import EmotionDetector, TrackState
 from chatbot import WellnessChatbot
 from mood_analytics import MoodAnalytics
 
@@ -19,7 +23,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
-app = FastAPI(title="MindWell AI", version="1.0.0")
+app = FastAPI(title="MindWell AI", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -30,10 +34,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize AI components
-emotion_detector = EmotionDetector()
-chatbot = WellnessChatbot()
-mood_analytics = MoodAnalytics()
+# AI components, initialized once per worker process in the startup hook
+emotion_detector: EmotionDetector = None
+chatbot: WellnessChatbot = None
+mood_analytics: MoodAnalytics = None
+
+# Mood entries, chat history and tip cursors live in process memory, so extra
+# workers would each hold a diverging copy; stay at one until that state is shared
+WORKERS = 1
+
+# Largest accepted upload; one byte more is read to detect oversized files
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# Micro-batching for streamed emotion inference
+MAX_BATCH = 32
+BATCH_WINDOW = 0.005  # seconds to wait for more frames before running a batch
+inference_queue: asyncio.Queue = None
+batch_worker_task: asyncio.Task = None
+
+# Face detection and model calls run here so they never block the event loop
+inference_pool: ThreadPoolExecutor = None
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -62,21 +82,125 @@ class ConnectionManager:
         logger.info("New WebSocket connection established")
 
     def disconnect(self, websocket: WebSocket):
+        if websocket not in self.active_connections:
+            return
         self.active_connections.remove(websocket)
         logger.info("WebSocket connection closed")
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                pass
+    async def broadcast(self, message: dict):
+        # Serialize once for every client, and send to all of them concurrently
+        # so one slow client does not hold up the rest
+        message = orjson.dumps(message)
+        connections = list(self.active_connections)
+        results = await asyncio.gather(
+            *(connection.send_bytes(message) for connection in connections),
+            return_exceptions=True
+        )
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error sending to WebSocket: {str(result)}")
+                self.disconnect(connection)
 
 manager = ConnectionManager()
 
+_iso_second = [0, ""]
+
+def fast_iso_now():
+    """Local ISO timestamp with milliseconds, formatting the date part once per second"""
+    now = time.time()
+    second = int(now)
+    if second != _iso_second[0]:
+        _iso_second[0] = second
+        _iso_second[1] = datetime.fromtimestamp(second).isoformat()
+    return f"{_iso_second[1]}.{int((now - second) * 1000):03d}"
+
+def decode_image(data):
+    """Decode an encoded image at half resolution; faces are resized to 48x48 anyway"""
+    nparr = np.frombuffer(data, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_REDUCED_COLOR_2)
+
+async def batch_worker():
+    """Coalesce queued faces into a single forward pass and resolve their futures"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await inference_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW
+        
+        # Drain whatever else arrives within the batching window
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(inference_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        # Every queued future must be resolved, whatever goes wrong below
+        try:
+            faces = np.concatenate([face for face, _ in batch])
+            results = await loop.run_in_executor(inference_pool, emotion_detector.predict_batch, faces)
+            if len(results) != len(batch):
+                raise ValueError(f"expected {len(batch)} predictions, got {len(results)}")
+        except Exception as e:
+            logger.error(f"Error in batched emotion prediction: {str(e)}")
+            results = [("Error", 0.0)] * len(batch)
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+async def predict_emotion_async(frame, track=None):
+    """Detect the face in frame and queue it for batched emotion inference"""
+    loop = asyncio.get_running_loop()
+    try:
+        cached_result, processed_face = await loop.run_in_executor(
+            inference_pool, emotion_detector.prepare_frame, frame, track
+        )
+    except Exception as e:
+        logger.error(f"Error extracting face: {str(e)}")
+        return "Error", 0.0
+    
+    if cached_result is not None:
+        return cached_result
+    
+    if processed_face is None:
+        result = ("No Face", 0.0)
+    else:
+        future = loop.create_future()
+        await inference_queue.put((processed_face, future))
+        result = await future
+    
+    # Remember the result so near-identical follow-up frames can reuse it
+    if track is not None and result[0] != "Error":
+        track.result = result
+    return result
+
+@app.on_event("startup")
+async def startup():
+    """Initialize AI components and the inference batcher in this worker"""
+    global emotion_detector, chatbot, mood_analytics, inference_queue, batch_worker_task, inference_pool
+    emotion_detector = EmotionDetector()
+    chatbot = WellnessChatbot()
+    mood_analytics = MoodAnalytics()
+    
+    # Split the cores between workers, and keep OpenCV single-threaded inside each
+    # pool thread so the pool is the only source of parallelism
+    cv2.setNumThreads(1)
+    inference_pool = ThreadPoolExecutor(max_workers=max(1, os.cpu_count() // WORKERS))
+    inference_queue = asyncio.Queue()
+    batch_worker_task = asyncio.create_task(batch_worker())
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the inference batcher and its thread pool, and snapshot mood entries"""
+    batch_worker_task.cancel()
+    inference_pool.shutdown(wait=False)
+    mood_analytics.close()
+
 @app.get("/")
 async def root():
     return {"message": "MindWell AI Backend - Mental Wellness Companion API"}
@@ -89,20 +213,25 @@ async def health_check():
 async def analyze_emotion(file: UploadFile = File(...)):
     """Analyze emotion from uploaded image"""
     try:
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        contents = await file.read(MAX_UPLOAD_BYTES + 1)
+        if len(contents) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Image too large")
+        
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(inference_pool, decode_image, contents)
         
         if image is None:
             raise HTTPException(status_code=400, detail="Invalid image format")
         
-        emotion, confidence = emotion_detector.predict_emotion(image)
+        emotion, confidence = await predict_emotion_async(image)
         
         return {
             "emotion": emotion,
             "confidence": float(confidence),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": fast_iso_now()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing emotion: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -116,6 +245,8 @@ async def save_mood_entry(entry: MoodEntry):
         
         mood_analytics.save_entry(entry.dict())
         return {"status": "success", "message": "Mood entry saved"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error saving mood entry: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -137,7 +268,7 @@ async def chat_with_bot(chat_message: ChatMessage):
         response = chatbot.get_response(chat_message.message, chat_message.user_id)
         return {
             "response": response,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": fast_iso_now()
         }
     except Exception as e:
         logger.error(f"Error in chat: {str(e)}")
@@ -147,48 +278,63 @@ async def chat_with_bot(chat_message: ChatMessage):
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time emotion detection"""
     await manager.connect(websocket)
+    loop = asyncio.get_running_loop()
+    track = TrackState()
     try:
         while True:
-            # Receive base64 encoded image
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            if message["type"] == "frame":
-                # Decode base64 image
-                image_data = base64.b64decode(message["data"].split(',')[1])
-                nparr = np.frombuffer(image_data, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            if message.get("bytes") is not None:
+                # Binary frame carrying the raw encoded image
+                image_data = message["bytes"]
+            else:
+                # Legacy JSON text frame carrying a base64 data URL
+                payload = orjson.loads(message["text"])
+                if payload["type"] != "frame":
+                    continue
+                image_data = base64.b64decode(payload["data"].split(',')[1])
+            
+            frame = await loop.run_in_executor(inference_pool, decode_image, image_data)
+            
+            if frame is not None:
+                # Detect emotion
+                emotion, confidence = await predict_emotion_async(frame, track)
                 
-                if frame is not None:
-                    # Detect emotion
-                    emotion, confidence = emotion_detector.predict_emotion(frame)
-                    
-                    # Send back emotion data
-                    response = {
-                        "type": "emotion",
-                        "emotion": emotion,
-                        "confidence": float(confidence),
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    
-                    await websocket.send_text(json.dumps(response))
+                # Send back emotion data
+                response = {
+                    "type": "emotion",
+                    "emotion": emotion,
+                    "confidence": float(confidence),
+                    "timestamp": fast_iso_now()
+                }
+                
+                await websocket.send_bytes(orjson.dumps(response))
                     
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
     except Exception as e:
         logger.error(f"WebSocket error: {str(e)}")
         await websocket.close()
+    finally:
+        # Always release the connection, however the stream ended
+        manager.disconnect(websocket)
 
 @app.get("/recommendations/{emotion}")
 async def get_recommendations(emotion: str):
     """Get personalized recommendations based on emotion"""
-    try:
-        recommendations = chatbot.get_emotion_recommendations(emotion)
-        return {"recommendations": recommendations}
-    except Exception as e:
-        logger.error(f"Error getting recommendations: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=chatbot.get_recommendations_json(emotion), media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # "auto" picks uvloop and httptools, which are installed from requirements.txt
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        ws="websockets",
+        workers=WORKERS
+    )
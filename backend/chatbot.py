@@ -1,16 +1,49 @@
 import json
 import random
+import itertools
+import ahocorasick
+import orjson
 from datetime import datetime
 import logging
+from collections import defaultdict, deque
 
 logger = logging.getLogger(__name__)
 
+# Message keywords; earlier groups take priority when several match
+MEDITATION_KEYWORDS = ['meditation', 'breathe', 'calm', 'relax']
+TIP_KEYWORDS = ['tip', 'advice', 'help', 'suggestion']
+EMOTION_KEYWORDS = {
+    'happy': 'Happy', 'joy': 'Happy', 'excited': 'Happy',
+    'sad': 'Sad', 'down': 'Sad', 'depressed': 'Sad',
+    'angry': 'Angry', 'mad': 'Angry', 'frustrated': 'Angry',
+    'scared': 'Fear', 'anxious': 'Fear', 'worried': 'Fear',
+    'surprised': 'Surprise', 'shocked': 'Surprise', 'unexpected': 'Surprise',
+    'okay': 'Neutral', 'fine': 'Neutral', 'neutral': 'Neutral'
+}
+
 class WellnessChatbot:
     def __init__(self):
-        self.conversation_history = {}
+        # Only the last 10 messages per user are kept
+        self.conversation_history = defaultdict(lambda: deque(maxlen=10))
         self.emotion_responses = self.load_emotion_responses()
-        self.wellness_tips = self.load_wellness_tips()
+        self.wellness_tips = tuple(self.load_wellness_tips())
+        
+        # Each user cycles through the tips in their own shuffled order
+        self.tip_cursors = defaultdict(
+            lambda: itertools.cycle(random.sample(self.wellness_tips, len(self.wellness_tips)))
+        )
         self.meditation_guides = self.load_meditation_guides()
+        self.keyword_automaton = self.build_keyword_automaton()
+        
+        # The response data is static, so format and serialize it once
+        self._recommendations_json = {
+            emotion: orjson.dumps({"recommendations": data['recommendations']})
+            for emotion, data in self.emotion_responses.items()
+        }
+        self._meditation_messages = {
+            name: self.format_meditation_guide(guide)
+            for name, guide in self.meditation_guides.items()
+        }
         
     def load_emotion_responses(self):
         """Load predefined responses for different emotions"""
@@ -140,14 +173,24 @@ class WellnessChatbot:
             }
         }
     
+    def build_keyword_automaton(self):
+        """Build one Aho-Corasick automaton tagging each keyword with (priority, category)"""
+        keywords = (
+            [(word, 'meditation') for word in MEDITATION_KEYWORDS] +
+            [(word, 'tip') for word in TIP_KEYWORDS] +
+            list(EMOTION_KEYWORDS.items())
+        )
+        
+        automaton = ahocorasick.Automaton()
+        for priority, (keyword, category) in enumerate(keywords):
+            automaton.add_word(keyword, (priority, category))
+        automaton.make_automaton()
+        return automaton
+    
     def get_response(self, message, user_id="default"):
         """Generate AI response based on user message"""
         message_lower = message.lower()
         
-        # Initialize conversation history for new users
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
         # Add user message to history
         self.conversation_history[user_id].append({
             "role": "user",
@@ -165,26 +208,46 @@ class WellnessChatbot:
             "timestamp": datetime.now().isoformat()
         })
         
-        # Keep only last 10 messages
-        self.conversation_history[user_id] = self.conversation_history[user_id][-10:]
-        
         return response
     
     def process_message(self, message, user_id):
         """Process message and generate appropriate response"""
         
-        # Check for meditation requests
-        if any(word in message for word in ['meditation', 'breathe', 'calm', 'relax']):
-            return self.get_meditation_guide()
+        # Scan the message once for all keywords and keep the highest-priority match
+        match = min((tag for _, tag in self.keyword_automaton.iter(message)), default=None)
         
-        # Check for wellness tips
-        if any(word in message for word in ['tip', 'advice', 'help', 'suggestion']):
-            return random.choice(self.wellness_tips)
+        if match is not None:
+            _, category = match
+            
+            # Meditation requests
+            if category == 'meditation':
+                return self.get_meditation_guide()
+            
+            # Wellness tips
+            if category == 'tip':
+                return next(self.tip_cursors[user_id])
+            
+            # Mood/emotion keywords
+            return random.choice(self.emotion_responses[category]['responses'])
         
-        # Check for mood/emotion keywords
-        emotion_keywords = {
-            'happy': 'Happy', 'joy': 'Happy', 'excited': 'Happy',
-            'sad': 'Sad', 'down': 'Sad', 'depressed': 'Sad',
-            'angry': 'Angry', 'mad': 'Angry', 'frustrated': 'Angry',
-            'scared': 'Fear', 'anxious': 'Fear', 'worried': 'Fear',
-            'surprised': 'Surprise',
+        # Default supportive response
+        return random.choice([
+            "I'm here to listen. How are you feeling right now?",
+            "Thank you for sharing. Would you like a wellness tip or a short meditation?",
+            "Tell me more about what's on your mind today."
+        ])
+    
+    def get_meditation_guide(self, guide_name=None):
+        """Get a meditation guide as a formatted message"""
+        if guide_name not in self._meditation_messages:
+            guide_name = random.choice(list(self._meditation_messages))
+        return self._meditation_messages[guide_name]
+    
+    def format_meditation_guide(self, guide):
+        """Format a meditation guide's title and numbered steps"""
+        steps = "\n".join(f"{i}. {step}" for i, step in enumerate(guide['steps'], 1))
+        return f"{guide['title']}\n\n{steps}"
+    
+    def get_recommendations_json(self, emotion):
+        """Get the pre-serialized recommendations response for an emotion, falling back to Neutral"""
+        return self._recommendations_json.get(emotion, self._recommendations_json['Neutral'])
@@ -1,35 +1,253 @@
+import os
+import shutil
+
+# oneDNN kernels must be enabled before TensorFlow is imported, unless the operator chose otherwise
+os.environ.setdefault("TF_ENABLE_ONEDNN_OPTS", "1")
+
 import cv2
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Dropout, Flatten, Conv2D, MaxPooling2D
 from tensorflow.keras.optimizers import Adam
-import os
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# A 48x48 forward pass is too small to benefit from wide op parallelism, and
+# extra threads only contend with the server for CPU
+INTRA_OP_THREADS = 2
+INTER_OP_THREADS = 1
+tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+tf.config.threading.set_inter_op_parallelism_threads(INTER_OP_THREADS)
+
+# INT8 inference is opt-in (MINDWELL_INT8=1), since it is only as accurate as
+# its calibration set: preprocessed face images placed in CALIBRATION_DIR
+USE_INT8 = os.environ.get('MINDWELL_INT8') == '1'
+CALIBRATION_DIR = 'models/calibration'
+INT8_MIN_AGREEMENT = 0.95  # fraction of calibration faces where INT8 must pick the FP32 label
+
+EMOTION_LABELS = ('Angry', 'Disgust', 'Fear', 'Happy', 'Sad', 'Surprise', 'Neutral')
+
+# Colors associated with each emotion for visualization
+EMOTION_COLORS = {
+    'Angry': (255, 0, 0),      # Red
+    'Disgust': (128, 0, 128),  # Purple
+    'Fear': (0, 0, 139),       # Dark Blue
+    'Happy': (255, 255, 0),    # Yellow
+    'Sad': (0, 0, 255),        # Blue
+    'Surprise': (255, 165, 0), # Orange
+    'Neutral': (128, 128, 128) # Gray
+}
+
+# YuNet face detector from the OpenCV model zoo
+# (https://github.com/opencv/opencv_zoo/tree/main/models/face_detection_yunet);
+# the Haar cascade is used when the model file is not present
+YUNET_MODEL_PATH = 'models/face_detection_yunet_2023mar.onnx'
+YUNET_SCORE_THRESHOLD = 0.6
+
+# Face tracking for streamed frames
+REDETECT_INTERVAL = 5  # run full-frame detection every N frames
+ROI_MARGIN = 0.15  # expand the previous face box by this fraction when tracking
+HASH_MATCH_DISTANCE = 2  # max differing dHash bits for a frame to reuse the last result
+MAX_RESULT_AGE = 1.0  # seconds a result may be reused before the face is analyzed again
+
+def frame_digest(frame):
+    """64-bit difference hash of a frame or face region, computed on a 9x8 grayscale thumbnail"""
+    thumbnail = cv2.cvtColor(cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return int.from_bytes(np.packbits(thumbnail[:, 1:] > thumbnail[:, :-1]).tobytes(), 'big')
+
+class TrackState:
+    """Per-stream face tracking state carried between consecutive frames"""
+    def __init__(self):
+        self.box = None
+        self.frame_count = 0
+        self.digest = None  # dHash of the face region of the last frame that was analyzed
+        self.analyzed_at = 0.0  # time.monotonic() when that frame was analyzed
+        self.result = None  # (emotion, confidence) for that frame
+
 class EmotionDetector:
     def __init__(self):
-        self.emotion_labels = ['Angry', 'Disgust', 'Fear', 'Happy', 'Sad', 'Surprise', 'Neutral']
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.emotion_labels = EMOTION_LABELS
+        self._local = threading.local()
+        self.use_yunet = hasattr(cv2, 'FaceDetectorYN') and os.path.exists(YUNET_MODEL_PATH)
+        logger.info(f"Using {'YuNet' if self.use_yunet else 'Haar cascade'} face detection")
         self.model = None
+        self._infer = None
+        self.interpreter = None
+        self._interpreters = {}
+        self._calibration_faces = None
         self.load_model()
     
+    @property
+    def face_cascade(self):
+        """Haar cascade owned by the calling thread, since detectors are not shared safely"""
+        face_cascade = getattr(self._local, 'face_cascade', None)
+        if face_cascade is None:
+            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            self._local.face_cascade = face_cascade
+        return face_cascade
+    
+    @property
+    def face_detector(self):
+        """YuNet detector owned by the calling thread, since its input size is per-call state"""
+        face_detector = getattr(self._local, 'face_detector', None)
+        if face_detector is None:
+            face_detector = cv2.FaceDetectorYN.create(
+                YUNET_MODEL_PATH, "", (320, 240),
+                score_threshold=YUNET_SCORE_THRESHOLD,
+                backend_id=cv2.dnn.DNN_BACKEND_OPENCV,
+                target_id=cv2.dnn.DNN_TARGET_CPU
+            )
+            self._local.face_detector = face_detector
+        return face_detector
+    
     def load_model(self):
         """Load pre-trained emotion detection model or create a new one"""
-        model_path = 'models/emotion_model.h5'
+        saved_model_path = 'models/emotion_model'
+        saved_model_file = os.path.join(saved_model_path, 'saved_model.pb')
+        h5_path = 'models/emotion_model.h5'
+        
+        # Prefer the SavedModel, which loads faster than HDF5, but only while it is
+        # at least as new as the .h5 it was converted from
+        saved_model_current = os.path.exists(saved_model_file) and (
+            not os.path.exists(h5_path) or os.path.getmtime(saved_model_file) >= os.path.getmtime(h5_path)
+        )
         
-        if os.path.exists(model_path):
+        model_file = None
+        if saved_model_current:
             try:
-                self.model = tf.keras.models.load_model(model_path)
+                self.model = tf.keras.models.load_model(saved_model_path)
+                model_file = saved_model_file
                 logger.info("Loaded pre-trained emotion model")
             except Exception as e:
-                logger.error(f"Error loading model: {e}")
+                logger.error(f"Error loading SavedModel, falling back to HDF5: {e}")
+        
+        if model_file is None:
+            if os.path.exists(h5_path):
+                try:
+                    self.model = tf.keras.models.load_model(h5_path)
+                    logger.info("Loaded pre-trained emotion model")
+                except Exception as e:
+                    logger.error(f"Error loading model: {e}")
+                    self.create_model()
+            else:
+                logger.info("Creating new emotion model")
                 self.create_model()
-        else:
-            logger.info("Creating new emotion model")
-            self.create_model()
+            model_file = h5_path
+            
+            # Convert so later startups load the SavedModel
+            try:
+                self.save_model(saved_model_path)
+                model_file = saved_model_file
+                logger.info("Converted emotion model to SavedModel format")
+            except Exception as e:
+                logger.error(f"Error converting model to SavedModel: {e}")
+        
+        self.build_inference_function()
+        if USE_INT8:
+            self.load_quantized_model(model_file)
+    
+    def build_inference_function(self):
+        """Trace the model once into a concrete function accepting any batch size"""
+        self._infer = tf.function(
+            lambda x: self.model(x, training=False),
+            input_signature=[tf.TensorSpec([None, 48, 48, 1], tf.float32)]
+        ).get_concrete_function()
+    
+    def load_quantized_model(self, model_path):
+        """Load the INT8 TFLite model, converting the Keras model when the cache is stale"""
+        tflite_path = 'models/emotion_model_int8.tflite'
+        
+        try:
+            self._calibration_faces = self.load_calibration_faces()
+            if len(self._calibration_faces) == 0:
+                logger.error(f"No calibration faces in {CALIBRATION_DIR}, using TensorFlow inference")
+                return
+            
+            if not os.path.exists(tflite_path) or os.path.getmtime(tflite_path) < os.path.getmtime(model_path):
+                self.quantize_model(tflite_path)
+            
+            self._tflite_path = tflite_path
+            self._interpreters = {}
+            self.interpreter = self.get_interpreter(1)
+            self._input_details = self.interpreter.get_input_details()[0]
+            self._output_details = self.interpreter.get_output_details()[0]
+            
+            # Keep the INT8 model only if it picks the same emotions as the FP32 model
+            faces = self._calibration_faces
+            int8_labels = np.argmax(np.concatenate([self.predict_quantized(face[None]) for face in faces]), axis=1)
+            fp32_labels = np.argmax(self._infer(tf.convert_to_tensor(faces)).numpy(), axis=1)
+            agreement = float(np.mean(int8_labels == fp32_labels))
+            if agreement < INT8_MIN_AGREEMENT:
+                raise ValueError(f"INT8 model matches FP32 on only {agreement:.0%} of calibration faces")
+            logger.info(f"Loaded INT8 emotion model ({agreement:.0%} agreement with FP32)")
+        except Exception as e:
+            logger.error(f"Error loading INT8 model, using TensorFlow inference: {e}")
+            self.interpreter = None
+            self._interpreters = {}
+    
+    def load_calibration_faces(self):
+        """Preprocessed face images from CALIBRATION_DIR as an Nx48x48x1 batch"""
+        faces = []
+        if os.path.isdir(CALIBRATION_DIR):
+            for name in sorted(os.listdir(CALIBRATION_DIR)):
+                image = cv2.imread(os.path.join(CALIBRATION_DIR, name), cv2.IMREAD_GRAYSCALE)
+                if image is not None:
+                    faces.append(self.preprocess_face(image))
+        return np.concatenate(faces) if faces else np.empty((0, 48, 48, 1), dtype=np.float32)
+    
+    def quantize_model(self, tflite_path):
+        """Convert the Keras model to a full-integer INT8 TFLite model"""
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = self.representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+        
+        # Write under a temporary name so a concurrent reader never sees a partial file
+        tmp_path = f"{tflite_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(converter.convert())
+        os.replace(tmp_path, tflite_path)
+        logger.info("Created and saved INT8 emotion model")
+    
+    def representative_dataset(self):
+        """Calibration samples drawn from real faces, one at a time"""
+        for face in self._calibration_faces:
+            yield [face[None]]
+    
+    def get_interpreter(self, batch_size):
+        """INT8 interpreter allocated for batch_size, created once per size"""
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = tf.lite.Interpreter(model_path=self._tflite_path, num_threads=INTRA_OP_THREADS)
+            if batch_size != 1:
+                input_index = interpreter.get_input_details()[0]['index']
+                interpreter.resize_tensor_input(input_index, (batch_size, 48, 48, 1))
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+    
+    def predict_quantized(self, faces):
+        """Run a batch through the INT8 interpreter and return dequantized probabilities"""
+        # Pad to the next power of two so only a handful of interpreter sizes are ever planned
+        batch_size = faces.shape[0]
+        padded_size = 1 << (batch_size - 1).bit_length()
+        interpreter = self.get_interpreter(padded_size)
+        
+        scale, zero_point = self._input_details['quantization']
+        quantized = np.zeros((padded_size, 48, 48, 1), dtype=np.int8)
+        quantized[:batch_size] = np.clip(np.round(faces / scale + zero_point), -128, 127)
+        interpreter.set_tensor(self._input_details['index'], quantized)
+        interpreter.invoke()
+        
+        output = interpreter.get_tensor(self._output_details['index'])[:batch_size]
+        scale, zero_point = self._output_details['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
     
     def create_model(self):
         """Create and compile emotion detection model"""
@@ -60,57 +278,145 @@ class EmotionDetector:
         # Create models directory if it doesn't exist
         os.makedirs('models', exist_ok=True)
         
-        # Save the initial model
-        self.model.save('models/emotion_model.h5')
+        # Save the initial model under a temporary name, then move it into place
+        tmp_path = f"models/emotion_model.tmp{os.getpid()}.h5"
+        self.model.save(tmp_path)
+        os.replace(tmp_path, 'models/emotion_model.h5')
         logger.info("Created and saved new emotion model")
     
+    def save_model(self, path):
+        """Save the model as a SavedModel under a temporary name, then move it into place"""
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        old_path = f"{path}.old{os.getpid()}"
+        self.model.save(tmp_path, save_format='tf')
+        try:
+            # A non-empty directory cannot be replaced directly, so move a stale
+            # or corrupt copy aside first
+            if os.path.isdir(path):
+                os.replace(path, old_path)
+            os.replace(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.rmtree(old_path, ignore_errors=True)
+    
     def preprocess_face(self, face_image):
         """Preprocess face image for emotion detection"""
+        # Convert to grayscale first so the resize only touches one channel
+        if face_image.ndim == 3:
+            face_image = cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY)
+        
         # Resize to 48x48
-        face_image = cv2.resize(face_image, (48, 48))
+        face_image = cv2.resize(face_image, (48, 48), interpolation=cv2.INTER_AREA)
         
-        # Convert to grayscale if needed
-        if len(face_image.shape) == 3:
-            face_image = cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY)
+        # Normalize pixel values straight into a float32 array and reshape for model input
+        return np.multiply(face_image, np.float32(1 / 255.0), dtype=np.float32).reshape(1, 48, 48, 1)
+    
+    def detect_face(self, image, min_size=(0, 0)):
+        """Return the best (x, y, w, h) face box in a BGR image, or None"""
+        if self.use_yunet:
+            face_detector = self.face_detector
+            face_detector.setInputSize((image.shape[1], image.shape[0]))
+            _, faces = face_detector.detect(image)
+            if faces is None:
+                return None
+            
+            # Get the highest-scoring face, clipped to the image
+            x, y, w, h = faces[np.argmax(faces[:, -1]), :4].astype(int)
+            x, y = max(x, 0), max(y, 0)
+            w, h = min(w, image.shape[1] - x), min(h, image.shape[0] - y)
+            return (x, y, w, h) if w > 0 and h > 0 else None
         
-        # Normalize pixel values
-        face_image = face_image.astype('float32') / 255.0
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, 1.3, 5, minSize=min_size)
+        if len(faces) == 0:
+            return None
         
-        # Reshape for model input
-        face_image = face_image.reshape(1, 48, 48, 1)
+        # Get the largest face
+        return tuple(max(faces, key=lambda x: x[2] * x[3]))
+    
+    def prepare_frame(self, frame, track=None):
+        """Return (cached_result, processed_face), reusing a recent result for near-identical faces"""
+        if track is not None:
+            # Hash the tracked face rather than the whole frame, so a change of
+            # expression flips enough bits to be noticed
+            region = frame
+            if track.box is not None:
+                x, y, w, h = track.box
+                region = frame[y:y+h, x:x+w]
+                if region.size == 0:
+                    region = frame
+            digest = frame_digest(region)
+            now = time.monotonic()
+            
+            if (track.result is not None and now - track.analyzed_at < MAX_RESULT_AGE
+                    and bin(digest ^ track.digest).count('1') <= HASH_MATCH_DISTANCE):
+                return track.result, None
+            track.digest = digest
+            track.analyzed_at = now
+            track.result = None
         
-        return face_image
+        return None, self.extract_face(frame, track)
+    
+    def extract_face(self, frame, track=None):
+        """Detect the best face in frame and return it preprocessed, or None"""
+        # Between periodic full-frame detections, only search around the last face
+        box = None
+        if track is not None and track.box is not None and track.frame_count % REDETECT_INTERVAL != 0:
+            box = self.track_face(frame, track.box)
+        
+        if box is None:
+            box = self.detect_face(frame)
+        
+        if track is not None:
+            track.box = box
+            track.frame_count = track.frame_count + 1 if box is not None else 0
+        
+        if box is None:
+            return None
+        
+        x, y, w, h = box
+        
+        # Extract face region; preprocess_face converts just this region to grayscale
+        face_roi = frame[y:y+h, x:x+w]
+        
+        return self.preprocess_face(face_roi)
+    
+    def track_face(self, frame, box):
+        """Re-detect a face only within the previous box expanded by ROI_MARGIN"""
+        x, y, w, h = box
+        margin_x, margin_y = int(w * ROI_MARGIN), int(h * ROI_MARGIN)
+        x0, y0 = max(x - margin_x, 0), max(y - margin_y, 0)
+        x1, y1 = min(x + w + margin_x, frame.shape[1]), min(y + h + margin_y, frame.shape[0])
+        
+        face = self.detect_face(frame[y0:y1, x0:x1], min_size=(w // 2, h // 2))
+        if face is None:
+            return None
+        
+        fx, fy, fw, fh = face
+        return (x0 + fx, y0 + fy, fw, fh)
+    
+    def predict_batch(self, faces):
+        """Predict emotions for a Bx48x48x1 batch of preprocessed faces in one forward pass"""
+        if self.interpreter is not None:
+            predictions = self.predict_quantized(faces)
+        else:
+            predictions = self._infer(tf.convert_to_tensor(faces)).numpy()
+        emotion_indices = np.argmax(predictions, axis=1)
+        
+        return [
+            (self.emotion_labels[index], float(prediction[index]))
+            for index, prediction in zip(emotion_indices, predictions)
+        ]
     
     def predict_emotion(self, frame):
         """Predict emotion from frame"""
         try:
-            # Convert to grayscale
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            processed_face = self.extract_face(frame)
             
-            # Detect faces
-            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
-            
-            if len(faces) > 0:
-                # Get the largest face
-                largest_face = max(faces, key=lambda x: x[2] * x[3])
-                x, y, w, h = largest_face
-                
-                # Extract face region
-                face_roi = gray[y:y+h, x:x+w]
-                
-                # Preprocess face
-                processed_face = self.preprocess_face(face_roi)
-                
-                # Predict emotion
-                predictions = self.model.predict(processed_face)
-                emotion_index = np.argmax(predictions[0])
-                confidence = predictions[0][emotion_index]
-                
-                emotion = self.emotion_labels[emotion_index]
-                
-                return emotion, float(confidence)
-            else:
+            if processed_face is None:
                 return "No Face", 0.0
+            
+            return self.predict_batch(processed_face)[0]
                 
         except Exception as e:
             logger.error(f"Error in emotion prediction: {e}")
@@ -118,16 +424,7 @@ class EmotionDetector:
     
     def get_emotion_color(self, emotion):
         """Get color associated with emotion for visualization"""
-        color_map = {
-            'Angry': (255, 0, 0),      # Red
-            'Disgust': (128, 0, 128),  # Purple
-            'Fear': (0, 0, 139),       # Dark Blue
-            'Happy': (255, 255, 0),    # Yellow
-            'Sad': (0, 0, 255),        # Blue
-            'Surprise': (255, 165, 0), # Orange
-            'Neutral': (128, 128, 128) # Gray
-        }
-        return color_map.get(emotion, (255, 255, 255))
+        return EMOTION_COLORS.get(emotion, (255, 255, 255))
     
     def draw_emotion_info(self, frame, emotion, confidence):
         """Draw emotion information on frame"""
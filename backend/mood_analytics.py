@@ -1,67 +1,375 @@
-import json
+import orjson
+import ahocorasick
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
 from typing import Dict, List, Any
 import os
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional columnar snapshots (pip install pyarrow)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 logger = logging.getLogger(__name__)
 
+# Emotions ordered from lowest to highest mood score
+EMOTION_CATS = pd.CategoricalDtype(['Angry', 'Disgust', 'Fear', 'Sad', 'Neutral', 'Surprise', 'Happy'], ordered=True)
+
+# Mood score per EMOTION_CATS code (positive emotions = higher score); the trailing
+# NaN is picked up by code -1, so unknown emotions stay out of the averages
+SCORE_TABLE = np.array([1, 1, 1, 2, 3, 4, 5, np.nan])
+
+# One mood entry; emotion and user_id are codes into per-instance vocabularies
+RECORD_DTYPE = np.dtype([
+    ('id', 'i8'),
+    ('timestamp', 'datetime64[ns]'),
+    ('emotion', 'i2'),
+    ('user_id', 'i4'),
+    ('intensity', 'i4'),
+    ('notes', 'O')
+])
+
+# Appended entries between Parquet snapshots
+SNAPSHOT_INTERVAL = 500
+
+DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+# Note keywords that hint at emotional triggers
+NOTE_KEYWORDS = {
+    'work': ['work', 'job', 'office', 'meeting', 'project'],
+    'relationship': ['friend', 'family', 'love', 'partner', 'relationship'],
+    'health': ['tired', 'sick', 'pain', 'exercise', 'sleep'],
+    'stress': ['stress', 'anxious', 'worried', 'overwhelmed', 'pressure']
+}
+
 class MoodAnalytics:
     def __init__(self):
-        self.data_file = 'data/mood_entries.json'
+        # Newline-delimited JSON, so each new entry is a single appended line
+        self.data_file = 'data/mood_entries.jsonl'
+        self.legacy_data_file = 'data/mood_entries.json'
+        
+        # Parquet copy of the entries up to a byte offset in the log, so a cold
+        # start skips parsing them; the JSON lines file stays the write-ahead log.
+        # Snapshots are written on one background thread, off the request path
+        self.snapshot_file = 'data/mood_entries.parquet'
+        self._unsnapshotted = 0
+        self._wal_offset = 0
+        self._snapshot_pool = ThreadPoolExecutor(max_workers=1)
+        
+        # Entries as fixed-dtype records in a growing array; emotions and user ids
+        # are stored as codes into these vocabularies
+        self._arr = np.empty(1024, dtype=RECORD_DTYPE)
+        self._n = 0
+        self._last_id = 0
+        self.emotion_labels = []
+        self._emotion_codes = {}
+        self.user_ids = []
+        self._user_codes = {}
+        
+        # Positions of the last 5 entries per user code
+        self._recent = defaultdict(lambda: deque(maxlen=5))
+        
+        # Timestamp-sorted DataFrame of all entries, plus per-user views of it
+        self._df_cache = None
+        self._cache_len = 0
+        self._user_groups = None
+        self._user_frames = {}
+        
+        self.notes_automaton = self.build_notes_automaton()
         self.ensure_data_directory()
         self.load_data()
     
+    def build_notes_automaton(self):
+        """Build one Aho-Corasick automaton mapping each note keyword to its category"""
+        automaton = ahocorasick.Automaton()
+        for category, words in NOTE_KEYWORDS.items():
+            for word in words:
+                automaton.add_word(word, category)
+        automaton.make_automaton()
+        return automaton
+    
     def ensure_data_directory(self):
-        """Ensure data directory exists"""
+        """Ensure data directory exists, migrating entries from the legacy JSON array file"""
         os.makedirs('data', exist_ok=True)
         if not os.path.exists(self.data_file):
-            with open(self.data_file, 'w') as f:
-                json.dump([], f)
+            if os.path.exists(self.legacy_data_file):
+                with open(self.legacy_data_file, 'rb') as f:
+                    entries = orjson.loads(f.read())
+                with open(self.data_file, 'wb') as f:
+                    f.writelines(orjson.dumps(entry) + b'\n' for entry in entries)
+                logger.info("Migrated mood entries to JSON lines format")
+            else:
+                open(self.data_file, 'w').close()
     
     def load_data(self):
-        """Load mood entry data"""
+        """Load mood entry data from the snapshot, replaying newer JSON lines"""
+        wal_offset = self.load_snapshot()
+        self._cache_len = 0
+        
         try:
-            with open(self.data_file, 'r') as f:
-                self.data = json.load(f)
+            with open(self.data_file, 'rb') as f:
+                # Start right after the last line the snapshot covers
+                f.seek(wal_offset)
+                line = b''
+                for line in f:
+                    if not line.strip():
+                        continue
+                    # A torn or corrupt line, e.g. from a crash mid-append, only loses itself
+                    try:
+                        self._append_record(orjson.loads(line))
+                    except Exception as e:
+                        logger.error(f"Skipping unreadable mood entry at byte {f.tell() - len(line)}: {e}")
+            
+            # Terminate a torn last line so the next append starts on a line of its own
+            if line and not line.endswith(b'\n'):
+                with open(self.data_file, 'ab') as f:
+                    f.write(b'\n')
+            self._wal_offset = os.path.getsize(self.data_file)
         except Exception as e:
             logger.error(f"Error loading data: {e}")
-            self.data = []
+        self._unsnapshotted = self._n - self._snapshot_len
+    
+    def load_snapshot(self) -> int:
+        """Load entries from the Parquet snapshot, returning the log offset it covers up to"""
+        self._snapshot_len = 0
+        if pq is None or not os.path.exists(self.snapshot_file):
+            return 0
+        try:
+            # Dictionary-encoded user_id comes back categorical and timestamps as datetime64[ns]
+            table = pq.read_table(self.snapshot_file)
+            wal_offset = int((table.schema.metadata or {}).get(b'wal_offset', -1))
+            if not 0 <= wal_offset <= os.path.getsize(self.data_file):
+                logger.error("Snapshot does not match the mood entry log, replaying the whole log")
+                return 0
+            df = table.to_pandas()
+        except Exception as e:
+            logger.error(f"Error loading snapshot: {e}")
+            return 0
+        
+        self._reserve(len(df))
+        records = self._arr[:len(df)]
+        records['id'] = df['id'].to_numpy(np.int64)
+        records['timestamp'] = df['timestamp'].to_numpy('datetime64[ns]')
+        records['emotion'] = self._encode(df['emotion'], self.emotion_labels, self._emotion_codes)
+        records['user_id'] = self._encode(df['user_id'], self.user_ids, self._user_codes)
+        records['intensity'] = df['intensity'].fillna(0).to_numpy(np.int32)
+        notes = df['notes'].to_numpy(object)
+        records['notes'] = np.where(pd.isna(notes), None, notes)
+        self._n = self._snapshot_len = len(df)
+        self._last_id = int(records['id'].max(initial=0))
+        for position, user_code in enumerate(records['user_id'].tolist()):
+            self._recent[user_code].append(position)
+        return wal_offset
     
-    def save_data(self):
-        """Save mood entry data"""
+    def save_snapshot(self):
+        """Snapshot all entries to Parquet in the background if any were added since the last one"""
+        if pq is None or not self._unsnapshotted:
+            return
+        
+        # Copy the records and vocabularies so the write never sees later appends
+        self._snapshot_pool.submit(
+            self._write_snapshot, self._arr[:self._n].copy(),
+            list(self.emotion_labels), list(self.user_ids), self._wal_offset
+        )
+        self._snapshot_len = self._n
+        self._unsnapshotted = 0
+    
+    def _write_snapshot(self, records: np.ndarray, emotion_labels: List[str], user_ids: List[str], wal_offset: int):
+        """Write records to the Parquet snapshot, tagged with the log offset they cover up to"""
         try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.data, f, indent=2)
+            df = pd.DataFrame({
+                'id': records['id'],
+                'timestamp': records['timestamp'],
+                'emotion': self._labels(records['emotion'], emotion_labels),
+                'user_id': pd.Categorical.from_codes(records['user_id'], user_ids),
+                'intensity': records['intensity'],
+                'notes': records['notes']
+            })
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}), b'wal_offset': str(wal_offset).encode()
+            })
+            tmp_file = self.snapshot_file + '.tmp'
+            pq.write_table(table, tmp_file, use_dictionary=['emotion', 'user_id'])
+            os.replace(tmp_file, self.snapshot_file)
         except Exception as e:
-            logger.error(f"Error saving data: {e}")
+            logger.error(f"Error saving snapshot: {e}")
+    
+    def close(self):
+        """Snapshot any new entries and wait for pending snapshot writes"""
+        self.save_snapshot()
+        self._snapshot_pool.shutdown(wait=True)
     
     def save_entry(self, entry: Dict[str, Any]):
         """Save a new mood entry"""
-        entry['id'] = len(self.data) + 1
-        entry['timestamp'] = entry.get('timestamp', datetime.now().isoformat())
-        self.data.append(entry)
-        self.save_data()
+        # Validate the timestamp before anything is stored, and log it in local time
+        timestamp = entry.get('timestamp') or datetime.now().isoformat()
+        entry['timestamp'] = pd.Timestamp(self._parse_timestamp(timestamp)).isoformat()
+        
+        # Ids keep increasing past entries that failed to load, so they are never reused
+        entry['id'] = self._last_id + 1
+        self._append_record(entry)
+        
+        # Append just this entry rather than rewriting the whole file
+        try:
+            line = orjson.dumps(entry) + b'\n'
+            with open(self.data_file, 'ab', buffering=1 << 16) as f:
+                f.write(line)
+            self._wal_offset += len(line)
+        except Exception as e:
+            logger.error(f"Error saving entry: {e}")
+        
+        self._unsnapshotted += 1
+        if self._unsnapshotted >= SNAPSHOT_INTERVAL:
+            self.save_snapshot()
+    
+    def _reserve(self, size: int):
+        """Grow the record array, doubling its capacity, until it holds size records"""
+        capacity = len(self._arr)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        grown = np.empty(capacity, dtype=RECORD_DTYPE)
+        grown[:self._n] = self._arr[:self._n]
+        self._arr = grown
+    
+    def _append_record(self, entry: Dict[str, Any]):
+        """Store one entry as a record at the end of the array"""
+        self._reserve(self._n + 1)
+        record = self._arr[self._n]
+        entry_id = entry.get('id') or self._last_id + 1
+        record['id'] = entry_id
+        record['timestamp'] = self._parse_timestamp(entry['timestamp'])
+        record['emotion'] = self._code(entry.get('emotion'), self.emotion_labels, self._emotion_codes)
+        user_code = self._code(entry.get('user_id') or 'default', self.user_ids, self._user_codes)
+        record['user_id'] = user_code
+        record['intensity'] = entry.get('intensity') or 0
+        record['notes'] = entry.get('notes')
+        self._recent[user_code].append(self._n)
+        self._last_id = max(self._last_id, entry_id)
+        self._n += 1
+    
+    def _parse_timestamp(self, value) -> np.datetime64:
+        """Parse an ISO timestamp as naive local time, the convention for every stored entry"""
+        try:
+            timestamp = pd.Timestamp(value) if isinstance(value, str) else pd.NaT
+        except ValueError:
+            raise ValueError(f"Invalid timestamp: {value!r}")
+        if timestamp is pd.NaT:
+            raise ValueError(f"Invalid timestamp: {value!r}")
+        
+        # Clients send UTC ('...Z'); convert offset-aware times to the server's local time
+        if timestamp.tzinfo is not None:
+            timestamp = pd.Timestamp(timestamp.to_pydatetime().astimezone().replace(tzinfo=None))
+        return timestamp.to_datetime64()
+    
+    def _code(self, label, labels: List[str], codes: Dict[str, int]) -> int:
+        """Code of label in a vocabulary, adding it if new; missing labels are -1"""
+        if label is None:
+            return -1
+        if label not in codes:
+            codes[label] = len(labels)
+            labels.append(label)
+        return codes[label]
+    
+    def _encode(self, values: pd.Series, labels: List[str], codes: Dict[str, int]) -> np.ndarray:
+        """Codes of a column of labels in a vocabulary, adding new labels"""
+        value_codes, uniques = pd.factorize(values)
+        lookup = np.array([self._code(label, labels, codes) for label in uniques] + [-1])
+        return lookup[value_codes]
+    
+    def _labels(self, codes: np.ndarray, labels: List[str]) -> np.ndarray:
+        """Labels for codes as an object array, with None for code -1"""
+        return np.array(labels + [None], dtype=object)[codes]
+    
+    def _entry(self, position: int) -> Dict[str, Any]:
+        """Rebuild the saved entry at a position in the record array"""
+        record = self._arr[position]
+        return {
+            'emotion': self._labels(record['emotion'], self.emotion_labels),
+            'intensity': int(record['intensity']),
+            'notes': record['notes'],
+            'timestamp': pd.Timestamp(record['timestamp']).isoformat(),
+            'id': int(record['id'])
+        }
+    
+    def _build_df(self, start: int, stop: int) -> pd.DataFrame:
+        """Build a DataFrame of records indexed by their position in the record array"""
+        records = self._arr[start:stop]
+        return pd.DataFrame({
+            'emotion': pd.Categorical.from_codes(records['emotion'], self.emotion_labels),
+            'notes': records['notes'],
+            'user_id': pd.Categorical.from_codes(records['user_id'], self.user_ids),
+            'timestamp': records['timestamp']
+        }, index=pd.RangeIndex(start, stop))
+    
+    def _get_df(self, user_id: str) -> pd.DataFrame:
+        """Get the cached, timestamp-sorted DataFrame of a user's entries"""
+        if self._df_cache is None or self._cache_len > self._n:
+            self._df_cache = self._build_df(0, self._n).sort_values('timestamp', kind='stable')
+            self._cache_len = self._n
+            self._user_groups = None
+            self._user_frames = {}
+        elif self._cache_len < self._n:
+            self._extend_cache()
+        
+        # Row positions per user, grouped on the categorical codes
+        if self._user_groups is None:
+            self._user_groups = self._df_cache.groupby('user_id', observed=True).indices
+        
+        if user_id not in self._user_frames:
+            positions = self._user_groups.get(user_id, np.empty(0, dtype=np.intp))
+            self._user_frames[user_id] = self._df_cache.take(positions)
+        return self._user_frames[user_id]
+    
+    def _extend_cache(self):
+        """Append entries saved since the cache was built instead of rebuilding it"""
+        rows = self._build_df(self._cache_len, self._n)
+        
+        # Both frames share the full vocabularies so the concatenated columns stay categorical
+        for column, labels in (('emotion', self.emotion_labels), ('user_id', self.user_ids)):
+            if len(self._df_cache[column].cat.categories) != len(labels):
+                self._df_cache[column] = self._df_cache[column].cat.set_categories(labels)
+        
+        needs_sort = rows['timestamp'].min() < self._df_cache['timestamp'].iloc[-1]
+        self._df_cache = pd.concat([self._df_cache, rows])
+        if needs_sort:
+            self._df_cache = self._df_cache.sort_values('timestamp', kind='stable')
+        self._cache_len = self._n
+        self._user_groups = None
+        for user_id in rows['user_id'].unique():
+            self._user_frames.pop(user_id, None)
     
     def get_user_analytics(self, user_id: str = "default") -> Dict[str, Any]:
         """Get comprehensive analytics for a user"""
-        user_data = [entry for entry in self.data if entry.get('user_id', 'default') == user_id]
-        
-        if not user_data:
+        # Unknown users get nothing cached, so arbitrary ids cannot grow the frame cache
+        if not self._n or user_id not in self._user_codes:
             return self.get_empty_analytics()
         
-        df = pd.DataFrame(user_data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df = self._get_df(user_id)
+        
+        if df.empty:
+            return self.get_empty_analytics()
         
         # Basic statistics
-        total_entries = len(user_data)
-        emotion_counts = df['emotion'].value_counts().to_dict()
+        total_entries = len(df)
         
-        # Time-based analytics
-        last_7_days = df[df['timestamp'] >= datetime.now() - timedelta(days=7)]
-        last_30_days = df[df['timestamp'] >= datetime.now() - timedelta(days=30)]
+        # Emotion counts from one bincount over the stored emotion codes
+        codes = self._arr['emotion'][df.index.to_numpy()]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.emotion_labels))
+        most_common = self.emotion_labels[counts.argmax()] if counts.any() else None
+        order = np.argsort(-counts, kind='stable')
+        emotion_counts = {self.emotion_labels[code]: int(counts[code]) for code in order if counts[code]}
+        
+        # The frame is sorted by timestamp, so the range is its first and last row
+        timestamps = df['timestamp'].values
         
         # Mood trends
         mood_trends = self.calculate_mood_trends(df)
@@ -70,22 +378,22 @@ class MoodAnalytics:
         patterns = self.analyze_patterns(df)
         
         # Recommendations
-        recommendations = self.generate_recommendations(df)
+        recommendations = self.generate_recommendations(df, most_common)
         
         return {
             'summary': {
                 'total_entries': total_entries,
                 'date_range': {
-                    'start': df['timestamp'].min().isoformat(),
-                    'end': df['timestamp'].max().isoformat()
+                    'start': pd.Timestamp(timestamps[0]).isoformat(),
+                    'end': pd.Timestamp(timestamps[-1]).isoformat()
                 },
-                'most_common_emotion': max(emotion_counts.items(), key=lambda x: x[1])[0] if emotion_counts else None,
+                'most_common_emotion': most_common,
                 'emotion_distribution': emotion_counts
             },
             'trends': mood_trends,
             'patterns': patterns,
             'recommendations': recommendations,
-            'recent_entries': user_data[-5:] if len(user_data) > 5 else user_data
+            'recent_entries': [self._entry(i) for i in self._recent[self._user_codes[user_id]]]
         }
     
     def calculate_mood_trends(self, df: pd.DataFrame) -> Dict[str, Any]:
@@ -93,19 +401,31 @@ class MoodAnalytics:
         if len(df) < 2:
             return {'message': 'Not enough data for trends'}
         
-        # Create emotion scores (positive emotions = higher score)
-        emotion_scores = {
-            'Happy': 5, 'Surprise': 4, 'Neutral': 3,
-            'Sad': 2, 'Fear': 1, 'Angry': 1, 'Disgust': 1
-        }
-        
-        df['emotion_score'] = df['emotion'].map(emotion_scores)
-        
-        # Daily trends
-        daily_trends = df.groupby(df['timestamp'].dt.date)['emotion_score'].mean().to_dict()
-        
-        # Weekly trends
-        weekly_trends = df.groupby(df['timestamp'].dt.isocalendar().week)['emotion_score'].mean().to_dict()
+        # Emotion scores gathered by categorical code, remapping the stored
+        # vocabulary onto EMOTION_CATS (missing and unknown emotions become -1)
+        to_score_code = np.append(EMOTION_CATS.categories.get_indexer(df['emotion'].cat.categories), -1)
+        codes = to_score_code[df['emotion'].cat.codes.to_numpy()]
+        emotion_score = pd.Series(SCORE_TABLE[codes], index=df.index)
+        
+        # Per-entry sums and counts, leaving unknown emotions out of the means
+        known = ~np.isnan(emotion_score.to_numpy())
+        scores = np.where(known, emotion_score.to_numpy(), 0.0)
+        
+        # Daily trends: the frame is sorted by timestamp, so each day is one run
+        days = df['timestamp'].to_numpy().astype('datetime64[D]')
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        with np.errstate(invalid='ignore'):
+            daily_means = np.add.reduceat(scores, starts) / np.add.reduceat(known, starts)
+        daily_trends = dict(zip(days[starts].astype(str).tolist(), daily_means.tolist()))
+        
+        # Weekly trends: ISO week numbers wrap across years, so sum by week with bincount
+        weeks = self._iso_weeks(days)
+        week_sums = np.bincount(weeks, weights=scores, minlength=54)
+        week_counts = np.bincount(weeks, weights=known, minlength=54)
+        present = np.flatnonzero(np.bincount(weeks, minlength=54))
+        with np.errstate(invalid='ignore'):
+            weekly_means = week_sums[present] / week_counts[present]
+        weekly_trends = dict(zip(present.tolist(), weekly_means.tolist()))
         
         # Calculate trend direction
         if len(daily_trends) > 1:
@@ -118,31 +438,52 @@ class MoodAnalytics:
             trend_direction = 'insufficient_data'
         
         return {
-            'daily_trends': {str(k): v for k, v in daily_trends.items()},
+            'daily_trends': daily_trends,
             'weekly_trends': {str(k): v for k, v in weekly_trends.items()},
             'trend_direction': trend_direction,
-            'average_score': float(df['emotion_score'].mean()),
-            'score_std': float(df['emotion_score'].std())
+            'average_score': float(emotion_score.mean()),
+            'score_std': float(emotion_score.std())
         }
     
+    def _iso_weeks(self, days: np.ndarray) -> np.ndarray:
+        """ISO week numbers of datetime64[D] days, without building an isocalendar frame"""
+        # An ISO week belongs to the year its Thursday falls in (1970-01-01 was a Thursday)
+        day_numbers = days.astype(np.int64)
+        thursdays = day_numbers - (day_numbers + 3) % 7 + 3
+        jan_firsts = thursdays.astype('datetime64[D]').astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+        return ((thursdays - jan_firsts) // 7 + 1).astype(np.intp)
+    
     def analyze_patterns(self, df: pd.DataFrame) -> Dict[str, Any]:
         """Analyze emotional patterns"""
         if len(df) < 3:
             return {'message': 'Not enough data for pattern analysis'}
         
+        # Emotion codes ranked in alphabetical label order, so ties resolve like Series.mode
+        categories = df['emotion'].cat.categories
+        order = np.argsort(categories.to_numpy(), kind='stable')
+        rank = np.full(len(categories) + 1, -1, dtype=np.intp)
+        rank[order] = np.arange(len(categories))
+        emotion_codes = rank[df['emotion'].cat.codes.to_numpy()]
+        labels = categories[order]
+        known = emotion_codes >= 0
+        codes = emotion_codes[known]
+        
         # Time of day patterns
-        df['hour'] = df['timestamp'].dt.hour
-        hourly_patterns = df.groupby('hour')['emotion'].agg(lambda x: x.mode()[0] if len(x) > 0 else 'Neutral').to_dict()
+        hour = df['timestamp'].dt.hour.to_numpy()[known]
+        hourly_patterns = self._mode_by_key(hour, 24, codes, labels)
         
         # Day of week patterns
-        df['day_of_week'] = df['timestamp'].dt.day_name()
-        daily_patterns = df.groupby('day_of_week')['emotion'].agg(lambda x: x.mode()[0] if len(x) > 0 else 'Neutral').to_dict()
+        day_of_week = df['timestamp'].dt.dayofweek.to_numpy()[known]
+        daily_patterns = {
+            DAY_NAMES[day]: emotion
+            for day, emotion in self._mode_by_key(day_of_week, 7, codes, labels).items()
+        }
         
         # Emotional triggers (based on notes)
         notes_analysis = self.analyze_notes(df)
         
-        # Mood stability
-        emotion_changes = df['emotion'].ne(df['emotion'].shift()).sum()
+        # Mood stability: the first entry counts as a change, then every code switch
+        emotion_changes = 1 + np.count_nonzero(np.diff(emotion_codes))
         stability_score = 1 - (emotion_changes / len(df))
         
         return {
@@ -150,117 +491,72 @@ class MoodAnalytics:
             'daily_patterns': daily_patterns,
             'mood_stability': float(stability_score),
             'notes_analysis': notes_analysis,
-            'emotional_variety': len(df['emotion'].unique())
+            'emotional_variety': len(np.unique(emotion_codes))
         }
     
+    def _mode_by_key(self, keys: np.ndarray, n_keys: int, codes: np.ndarray, labels) -> Dict[int, str]:
+        """Most frequent label for each key that occurs, from one key x label count table"""
+        n_labels = len(labels)
+        if n_labels == 0:
+            return {}
+        
+        counts = np.bincount(keys * n_labels + codes, minlength=n_keys * n_labels).reshape(n_keys, n_labels)
+        present = np.flatnonzero(counts.any(axis=1))
+        modes = counts[present].argmax(axis=1)
+        return {int(key): labels[mode] for key, mode in zip(present, modes)}
+    
     def analyze_notes(self, df: pd.DataFrame) -> Dict[str, Any]:
         """Analyze notes for emotional triggers"""
-        if 'notes' not in df.columns or df['notes'].isna().all():
+        # Work on the note and emotion columns directly rather than a filtered copy of the frame
+        notes = df['notes'].to_numpy()
+        has_note = pd.notna(notes)
+        if not has_note.any():
             return {'message': 'No notes available for analysis'}
+        notes = notes[has_note]
         
-        notes_df = df[df['notes'].notna()]
-        if len(notes_df) == 0:
-            return {'message': 'No valid notes for analysis'}
-        
-        # Simple keyword analysis
-        keywords = {
-            'work': ['work', 'job', 'office', 'meeting', 'project'],
-            'relationship': ['friend', 'family', 'love', 'partner', 'relationship'],
-            'health': ['tired', 'sick', 'pain', 'exercise', 'sleep'],
-            'stress': ['stress', 'anxious', 'worried', 'overwhelmed', 'pressure']
-        }
-        
-        keyword_matches = {}
-        for category, words in keywords.items():
-            matches = notes_df['notes'].str.contains('|'.join(words), case=False, na=False).sum()
-            keyword_matches[category] = int(matches)
+        # Simple keyword analysis: one scan per note counts every category it mentions
+        keyword_matches = dict.fromkeys(NOTE_KEYWORDS, 0)
+        for note in notes:
+            if isinstance(note, str):
+                for category in {category for _, category in self.notes_automaton.iter(note.lower())}:
+                    keyword_matches[category] += 1
         
-        # Emotion-note correlation
-        emotion_note_pairs = notes_df.groupby('emotion')['notes'].count().to_dict()
+        # Emotion-note correlation: notes per emotion, in alphabetical order like a groupby
+        codes, labels = pd.factorize(df['emotion'].to_numpy()[has_note], sort=True)
+        counts = np.bincount(codes[codes >= 0], minlength=len(labels))
+        emotion_note_pairs = dict(zip(labels, counts.tolist()))
         
         return {
             'keyword_matches': keyword_matches,
             'emotion_note_correlation': emotion_note_pairs,
-            'total_notes_analyzed': len(notes_df)
+            'total_notes_analyzed': len(notes)
         }
     
-    def generate_recommendations(self, df: pd.DataFrame) -> List[str]:
-        """Generate personalized recommendations"""
+    def generate_recommendations(self, df: pd.DataFrame, most_common: str = None) -> List[str]:
+        """Generate personalized recommendations from the user's most common emotion"""
         recommendations = []
         
-        emotion_counts = df['emotion'].value_counts()
-        
-        # Based on most common emotion
-        if not emotion_counts.empty:
-            most_common = emotion_counts.index[0]
-            
+        # Based on most common emotion, already counted by get_user_analytics
+        if most_common is not None:
             if most_common in ['Sad', 'Angry', 'Fear']:
                 recommendations.extend([
                     "Consider daily mindfulness practice for emotional regulation",
-                    "Try journaling your feelings to process<create_file>
-<path>mindwell-ai/backend/mood_analytics.py</path>
-<content>
-import pandas as pd
-import os
-import json
-from datetime import datetime
-import logging
-
-logger = logging.getLogger(__name__)
-
-class MoodAnalytics:
-    def __init__(self):
-        self.data_file = 'mood_data.json'
-        self.data = []
-        self.load_data()
-    
-    def load_data(self):
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r') as f:
-                    self.data = json.load(f)
-                logger.info("Loaded mood data")
-            except Exception as e:
-                logger.error(f"Error loading mood data: {e}")
-                self.data = []
-        else:
-            self.data = []
-    
-    def save_data(self):
-        try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.data, f, indent=4)
-            logger.info("Saved mood data")
-        except Exception as e:
-            logger.error(f"Error saving mood data: {e}")
-    
-    def save_entry(self, entry):
-        """Save a new mood entry"""
-        self.data.append(entry)
-        self.save_data()
-    
-    def get_user_analytics(self, user_id):
-        """Return analytics for a user"""
-        # For now, user_id is not used, but can be extended
-        if not self.data:
-            return {"message": "No mood data available"}
-        
-        df = pd.DataFrame(self.data)
-        
-        # Convert timestamp to datetime
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        
-        # Basic stats
-        emotion_counts = df['emotion'].value_counts().to_dict()
-        avg_intensity = df['intensity'].mean() if 'intensity' in df.columns else None
-        
-        # Time series data for mood tracking
-        time_series = df.groupby(df['timestamp'].dt.date)['intensity'].mean().fillna(0).to_dict()
+                    "Try journaling your feelings to process them"
+                ])
         
-        analytics = {
-            "emotion_counts": emotion_counts,
-            "average_intensity": avg_intensity,
-            "time_series": time_series
+        return recommendations
+    
+    def get_empty_analytics(self) -> Dict[str, Any]:
+        """Get analytics structure for a user without entries"""
+        return {
+            'summary': {
+                'total_entries': 0,
+                'date_range': None,
+                'most_common_emotion': None,
+                'emotion_distribution': {}
+            },
+            'trends': {'message': 'Not enough data for trends'},
+            'patterns': {'message': 'Not enough data for pattern analysis'},
+            'recommendations': [],
+            'recent_entries': []
         }
-        
-        return analytics
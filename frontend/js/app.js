@@ -91,8 +91,8 @@ class MindWellApp {
 
     updateDashboardCards(analytics) {
         // Update emotion distribution
-        if (analytics.emotion_counts) {
-            this.updateEmotionChart(analytics.emotion_counts);
+        if (analytics.summary && analytics.summary.emotion_distribution) {
+            this.updateEmotionChart(analytics.summary.emotion_distribution);
         }
 
         // Update stats
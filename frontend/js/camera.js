@@ -26,13 +26,17 @@ class CameraManager {
     setupWebSocket() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
         this.ws = new WebSocket(`${protocol}//localhost:8000/ws/emotion-stream`);
+        this.ws.binaryType = 'arraybuffer';
+        this.textDecoder = new TextDecoder();
         
         this.ws.onopen = () => {
             console.log('WebSocket connected for emotion streaming');
         };
         
         this.ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+            // The server sends JSON as binary frames
+            const text = typeof event.data === 'string' ? event.data : this.textDecoder.decode(event.data);
+            const data = JSON.parse(text);
             this.handleEmotionData(data);
         };
         
@@ -104,14 +108,12 @@ class CameraManager {
             const tempCtx = tempCanvas.getContext('2d');
             tempCtx.drawImage(this.video, 0, 0, 640, 480);
 
-            // Convert to base64
-            const imageData = tempCanvas.toDataURL('image/jpeg', 0.8);
-            
-            // Send to backend
-            this.ws.send(JSON.stringify({
-                type: 'frame',
-                data: imageData
-            }));
+            // Send the raw JPEG bytes as a binary frame
+            tempCanvas.toBlob((blob) => {
+                if (blob && this.ws && this.ws.readyState === WebSocket.OPEN) {
+                    this.ws.send(blob);
+                }
+            }, 'image/jpeg', 0.8);
 
             // Continue sending frames
             setTimeout(sendFrame, 100); // 10 FPS
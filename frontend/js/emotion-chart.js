@@ -183,9 +183,10 @@ class EmotionChart {
     }
 
     updateCharts(analytics) {
-        if (analytics.emotion_counts && this.charts.distribution) {
-            const labels = Object.keys(analytics.emotion_counts);
-            const data = Object.values(analytics.emotion_counts);
+        const distribution = analytics.summary && analytics.summary.emotion_distribution;
+        if (distribution && this.charts.distribution) {
+            const labels = Object.keys(distribution);
+            const data = Object.values(distribution);
             
             this.charts.distribution.data.labels = labels;
             this.charts.distribution.data.datasets[0].data = data;